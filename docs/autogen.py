@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import re
+import filecmp
 import inspect
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 from elephas import spark_model, ml_model
@@ -82,21 +85,29 @@ PAGES = [
 
 ROOT = 'http://danielenricocahall.com/elephas'
 
+# Patterns used when processing docstrings, compiled once at import time.
+_NON_SPACE_RE = re.compile(r'\S')
+_CODE_BLOCK_RE = re.compile(r'```.*?```', re.DOTALL)
+_SECTION_RE = re.compile(r'\n( +)# (.*)\n')
+_SECTION_TITLE_RE = re.compile(r'\n(\s+)# (.*)\n')
+_TOP_LEVEL_RE = re.compile(r'^    ([^\s\\\(]+):(.*)', re.MULTILINE)
+_LEADING_4_SPACES_RE = re.compile(r'^    ', re.MULTILINE)
+
+# The same objects show up on several pages, so avoid re-reading and re-parsing their source.
+_cached_signature = lru_cache(maxsize=None)(inspect.signature)
+_cached_getsourcelines = lru_cache(maxsize=None)(inspect.getsourcelines)
+
 
 def get_function_signature(function, method=True):
     wrapped = getattr(function, '_original_function', None)
     if wrapped is None:
-        signature = inspect.signature(function)
+        signature = _cached_signature(function)
     else:
-        signature = inspect.signature(wrapped)
-    parameters = [str(p[1]) for p in signature.parameters.items()]
+        signature = _cached_signature(wrapped)
+    parameters = [str(p) for p in signature.parameters.values()]
     if method:
         parameters = parameters[1:]
-    st = '%s.%s(' % (clean_module_name(function.__module__), function.__name__)
-
-    for p in parameters:
-        st += str(p) + ', '
-    return st[:-2] + ')'
+    return f"{clean_module_name(function.__module__)}.{function.__name__}({', '.join(parameters)})"
 
 
 def get_class_signature(cls):
@@ -129,7 +140,7 @@ def class_to_source_link(cls):
     module_name = clean_module_name(cls.__module__)
     path = module_name.replace('.', '/')
     path += '.py'
-    line = inspect.getsourcelines(cls)[-1]
+    line = _cached_getsourcelines(cls)[-1]
     link = ('https://github.com/danielenricocahall/'
             'elephas/blob/master/' + path + '#L' + str(line))
     return '[[source]](' + link + ')'
@@ -143,7 +154,7 @@ def code_snippet(snippet):
 
 
 def count_leading_spaces(s):
-    ws = re.search(r'\S', s)
+    ws = _NON_SPACE_RE.search(s)
     if ws:
         return ws.start()
     else:
@@ -152,26 +163,27 @@ def count_leading_spaces(s):
 
 def process_list_block(docstring, starting_point, leading_spaces, marker):
     ending_point = docstring.find('\n\n', starting_point)
-    block = docstring[starting_point:(None if ending_point == -1 else
-                                      ending_point - 1)]
+    if ending_point == -1:
+        ending_point = len(docstring)
+    else:
+        ending_point -= 1
+    block = docstring[starting_point:ending_point]
     # Place marker for later reinjection.
-    docstring = docstring.replace(block, marker)
-    lines = block.split('\n')
+    docstring = docstring[:starting_point] + marker + docstring[ending_point:]
     # Remove the computed number of leading white spaces from each line.
-    lines = [re.sub('^' + ' ' * leading_spaces, '', line) for line in lines]
+    block = re.sub('^' + ' ' * leading_spaces, '', block, flags=re.MULTILINE)
     # Usually lines have at least 4 additional leading spaces.
     # These have to be removed, but first the list roots have to be detected.
-    top_level_regex = r'^    ([^\s\\\(]+):(.*)'
-    top_level_replacement = r'- __\1__:\2'
-    lines = [re.sub(top_level_regex, top_level_replacement, line) for line in lines]
+    block = _TOP_LEVEL_RE.sub(r'- __\1__:\2', block)
     # All the other lines get simply the 4 leading space (if present) removed
-    lines = [re.sub(r'^    ', '', line) for line in lines]
+    block = _LEADING_4_SPACES_RE.sub('', block)
+    lines = block.split('\n')
     # Fix text lines after lists
     indent = 0
     text_block = False
     for i in range(len(lines)):
         line = lines[i]
-        spaces = re.search(r'\S', line)
+        spaces = _NON_SPACE_RE.search(line)
         if spaces:
             # If it is a list element
             if line[spaces.start()] == '-':
@@ -190,19 +202,19 @@ def process_list_block(docstring, starting_point, leading_spaces, marker):
     return docstring, block
 
 
+@lru_cache(maxsize=None)
 def process_docstring(docstring):
     # First, extract code blocks and process them.
     code_blocks = []
     if '```' in docstring:
-        tmp = docstring[:]
-        while '```' in tmp:
-            tmp = tmp[tmp.find('```'):]
-            index = tmp[3:].find('```') + 6
-            snippet = tmp[:index]
-            # Place marker in docstring for later reinjection.
-            docstring = docstring.replace(
-                snippet, '$CODE_BLOCK_%d' % len(code_blocks))
-            snippet_lines = snippet.split('\n')
+        # Place markers in docstring for later reinjection.
+        chunks = []
+        prev_end = 0
+        for match in _CODE_BLOCK_RE.finditer(docstring):
+            chunks.append(docstring[prev_end:match.start()])
+            chunks.append('$CODE_BLOCK_%d' % len(code_blocks))
+            prev_end = match.end()
+            snippet_lines = match.group().split('\n')
             # Remove leading spaces.
             num_leading_spaces = snippet_lines[-1].find('`')
             snippet_lines = ([snippet_lines[0]] +
@@ -227,11 +239,11 @@ def process_docstring(docstring):
                                  [snippet_lines[-1]])
             snippet = '\n'.join(snippet_lines)
             code_blocks.append(snippet)
-            tmp = tmp[index:]
+        chunks.append(docstring[prev_end:])
+        docstring = ''.join(chunks)
 
     # Format docstring lists.
-    section_regex = r'\n( +)# (.*)\n'
-    section_idx = re.search(section_regex, docstring)
+    section_idx = _SECTION_RE.search(docstring)
     shift = 0
     sections = {}
     while section_idx and section_idx.group(2):
@@ -244,12 +256,10 @@ def process_docstring(docstring):
                                                 leading_spaces,
                                                 marker)
         sections[marker] = content
-        section_idx = re.search(section_regex, docstring[shift:])
+        section_idx = _SECTION_RE.search(docstring[shift:])
 
     # Format docstring section titles.
-    docstring = re.sub(r'\n(\s+)# (.*)\n',
-                       r'\n\1__\2__\n\n',
-                       docstring)
+    docstring = _SECTION_TITLE_RE.sub(r'\n\1__\2__\n\n', docstring)
 
     # Strip all remaining leading spaces.
     lines = docstring.split('\n')
@@ -266,34 +276,56 @@ def process_docstring(docstring):
     return docstring
 
 
-if os.path.exists(PWD/'sources'):
-    print('Cleaning up existing sources directory.')
-    shutil.rmtree(PWD/'sources')
-
-print('Populating sources directory with templates.')
-for subdir, dirs, fnames in os.walk(PWD/'templates'):
-    for fname in fnames:
-        new_subdir = subdir.replace(str(PWD/'templates'), str(PWD/'sources'))
-        if not os.path.exists(PWD/new_subdir):
-            os.makedirs(PWD/new_subdir)
-        if fname[-3:] == '.md':
-            fpath = str(PWD/os.path.join(subdir, fname))
-            new_fpath = fpath.replace('templates', 'sources')
-            shutil.copy(fpath, new_fpath)
-
-
+@lru_cache(maxsize=None)
 def read_file(path):
     with open(path) as f:
         return f.read()
 
 
+def write_file(path, content):
+    """Write content to path, unless the file already holds exactly that content.
+    Leaving up-to-date files untouched keeps their mtimes, so incremental mkdocs builds stay cheap.
+    """
+    path = Path(path)
+    new = content.encode()
+    if path.exists() and path.read_bytes() == new:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(new)
+
+
+def copy_if_changed(src, dst):
+    if not (os.path.exists(dst) and filecmp.cmp(src, dst, shallow=False)):
+        shutil.copy2(src, dst)
+    return dst
+
+
+def remove_stale_files(directory, keep):
+    """Delete the files under directory which aren't in keep, e.g. pages removed from the templates or PAGES,
+    along with the directories left empty.
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    for root, dirs, files in os.walk(directory, topdown=False):
+        for name in files:
+            path = os.path.abspath(os.path.join(root, name))
+            if path not in keep:
+                os.remove(path)
+        if root != str(directory) and not os.listdir(root):
+            os.rmdir(root)
+
+
+@lru_cache(maxsize=None)
+def _all_routines(cls):
+    return tuple(inspect.getmembers(cls, predicate=inspect.isroutine))
+
+
 def collect_class_methods(cls, methods):
     if isinstance(methods, (list, tuple)):
         return [getattr(cls, m) if isinstance(m, str) else m for m in methods]
-    methods = []
-    for _, method in inspect.getmembers(cls, predicate=inspect.isroutine):
-        methods.append(method)
-    return methods
+    collected = []
+    for _, method in _all_routines(cls):
+        collected.append(method)
+    return collected
 
 
 def render_function(function, method=True):
@@ -315,15 +347,17 @@ def read_page_data(page_data, type):
     data = page_data.get(type, [])
     for module in page_data.get('all_module_{}'.format(type), []):
         module_data = []
-        for name in dir(module):
-            module_member = getattr(module, name)
+        seen = set()
+        for module_member in vars(module).values():
             if (inspect.isclass(module_member) and type == 'classes' or
                inspect.isfunction(module_member) and type == 'functions'):
                 instance = module_member
                 if module.__name__ in instance.__module__:
-                    if instance not in module_data:
+                    if id(instance) not in seen:
+                        seen.add(id(instance))
                         module_data.append(instance)
-        module_data.sort(key=lambda x: id(x))
+        # sort by name, so the page content doesn't depend on memory layout
+        module_data.sort(key=lambda x: x.__name__)
         data += module_data
     return data
 
@@ -336,74 +370,118 @@ def replace_strikethroughs(index: str):
     return index
 
 
+def _render_page(page_index):
+    """Render the markdown of a single entry of PAGES.
+
+    Pages are looked up by index so that the function can be dispatched to a
+    process pool, as the page data itself references modules which can't be pickled.
+    """
+    page_data = PAGES[page_index]
+    classes = read_page_data(page_data, 'classes')
+
+    blocks = []
+    for element in classes:
+        if not isinstance(element, (list, tuple)):
+            element = (element, [])
+        cls = element[0]
+        subblocks = []
+        signature = get_class_signature(cls)
+        subblocks.append('<span style="float:right;">' +
+                         class_to_source_link(cls) + '</span>')
+        if element[1]:
+            subblocks.append('## ' + cls.__name__ + ' class\n')
+        else:
+            subblocks.append('### ' + cls.__name__ + '\n')
+        subblocks.append(code_snippet(signature))
+        docstring = cls.__doc__
+        if docstring:
+            subblocks.append(process_docstring(docstring))
+        methods = collect_class_methods(cls, element[1])
+        if methods:
+            subblocks.append('\n---')
+            subblocks.append('## ' + cls.__name__ + ' methods\n')
+            subblocks.append('\n---\n'.join(
+                [render_function(method, method=True) for method in methods]))
+        blocks.append('\n'.join(subblocks))
+
+    methods = read_page_data(page_data, 'methods')
+
+    for method in methods:
+        blocks.append(render_function(method, method=True))
+
+    functions = read_page_data(page_data, 'functions')
+
+    for function in functions:
+        blocks.append(render_function(function, method=False))
+
+    if not blocks:
+        raise RuntimeError('Found no content for page ' +
+                           page_data['page'])
+
+    mkdown = '\n----\n\n'.join(blocks)
+    # save module page.
+    # Either insert content into existing page,
+    # or create page otherwise
+    page_name = page_data['page']
+    path = os.path.join(PWD/'sources', page_name)
+    template_path = PWD/'templates'/page_name
+    if os.path.exists(template_path):
+        template = read_file(template_path)
+        assert '{{autogenerated}}' in template, ('Template found for ' + path +
+                                                 ' but missing {{autogenerated}}'
+                                                 ' tag.')
+        mkdown = template.replace('{{autogenerated}}', mkdown)
+        print('...inserting autogenerated content into template:', path)
+    else:
+        print('...creating new page with autogenerated content:', path)
+    return path, mkdown
+
+
+def _available_cpus():
+    try:
+        # respects cpusets / taskset restrictions, unlike os.cpu_count()
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
 if __name__ == '__main__':
+    # pages which get autogenerated content are written separately below
+    generated = {'index.md'} | {page_data['page'] for page_data in PAGES}
+    ignore_patterns = shutil.ignore_patterns('*.py', '__pycache__')
+
+    def ignore(directory, names):
+        relative_dir = os.path.relpath(directory, PWD/'templates')
+        return set(ignore_patterns(directory, names)) | {
+            name for name in names if os.path.normpath(os.path.join(relative_dir, name)) in generated}
+
+    # files written by this run, anything else left in sources is stale
+    written = set()
+
+    def copy_template(src, dst):
+        written.add(dst)
+        return copy_if_changed(src, dst)
+
+    print('Populating sources directory with templates.')
+    shutil.copytree(PWD/'templates', PWD/'sources',
+                    ignore=ignore,
+                    copy_function=copy_template,
+                    dirs_exist_ok=True)
+
     readme = read_file(PWD.parent/'README.md')
     index = read_file(PWD/'templates/index.md')
     index = index.replace('{{autogenerated}}', readme[readme.find('##'):])
     index = replace_strikethroughs(index)
-    with open(PWD/'sources/index.md', 'w') as f:
-        f.write(index)
+    write_file(PWD/'sources/index.md', index)
+    written.add(PWD/'sources/index.md')
 
     print('Generating Elephas docs')
-    for page_data in PAGES:
-        classes = read_page_data(page_data, 'classes')
-
-        blocks = []
-        for element in classes:
-            if not isinstance(element, (list, tuple)):
-                element = (element, [])
-            cls = element[0]
-            subblocks = []
-            signature = get_class_signature(cls)
-            subblocks.append('<span style="float:right;">' +
-                             class_to_source_link(cls) + '</span>')
-            if element[1]:
-                subblocks.append('## ' + cls.__name__ + ' class\n')
-            else:
-                subblocks.append('### ' + cls.__name__ + '\n')
-            subblocks.append(code_snippet(signature))
-            docstring = cls.__doc__
-            if docstring:
-                subblocks.append(process_docstring(docstring))
-            methods = collect_class_methods(cls, element[1])
-            if methods:
-                subblocks.append('\n---')
-                subblocks.append('## ' + cls.__name__ + ' methods\n')
-                subblocks.append('\n---\n'.join(
-                    [render_function(method, method=True) for method in methods]))
-            blocks.append('\n'.join(subblocks))
-
-        methods = read_page_data(page_data, 'methods')
-
-        for method in methods:
-            blocks.append(render_function(method, method=True))
-
-        functions = read_page_data(page_data, 'functions')
-
-        for function in functions:
-            blocks.append(render_function(function, method=False))
-
-        if not blocks:
-            raise RuntimeError('Found no content for page ' +
-                               page_data['page'])
-
-        mkdown = '\n----\n\n'.join(blocks)
-        # save module page.
-        # Either insert content into existing page,
-        # or create page otherwise
-        page_name = page_data['page']
-        path = os.path.join(PWD/'sources', page_name)
-        if os.path.exists(path):
-            template = read_file(path)
-            assert '{{autogenerated}}' in template, ('Template found for ' + path +
-                                                     ' but missing {{autogenerated}}'
-                                                     ' tag.')
-            mkdown = template.replace('{{autogenerated}}', mkdown)
-            print('...inserting autogenerated content into template:', path)
-        else:
-            print('...creating new page with autogenerated content:', path)
-        subdir = os.path.dirname(path)
-        if not os.path.exists(PWD/subdir):
-            os.makedirs(PWD/subdir)
-        with open(path, 'w') as f:
-            f.write(mkdown)
+    with ProcessPoolExecutor(max_workers=min(_available_cpus(), len(PAGES))) as executor:
+        pages = list(executor.map(_render_page, range(len(PAGES))))
+
+    # write the pages from the main process only
+    for path, mkdown in pages:
+        write_file(path, mkdown)
+        written.add(path)
+
+    remove_stale_files(PWD/'sources', written)
@@ -2,7 +2,8 @@ import copy
 import json
 import warnings
 from functools import partial
-from typing import Optional, Callable
+from itertools import islice
+from typing import Optional, Callable, Iterator, List, Any
 
 import h5py
 import numpy as np
@@ -10,7 +11,7 @@ from pyspark import keyword_only
 from pyspark.ml import Estimator, Model
 from pyspark.ml.param.shared import HasOutputCol, HasFeaturesCol, HasLabelCol
 from pyspark.ml.util import DefaultParamsReadable, DefaultParamsWritable
-from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql import DataFrame, SparkSession, Row
 from pyspark.sql.types import DoubleType, StructField, ArrayType
 from tensorflow.keras.models import model_from_json
 from tensorflow.keras.optimizers import get as get_optimizer
@@ -196,58 +197,52 @@ class ElephasTransformer(Model, HasKerasModelConfig, HasLabelCol, HasOutputCol,
         rdd = df.rdd
         weights = rdd.ctx.broadcast(self.weights)
 
-        def batched_prediction(data, inference_batch_size: int, features_col: str,
-                               predict_function: Callable[[np.array], np.array]) -> np.ndarray:
+        def batches(data, inference_batch_size: Optional[int] = None) -> Iterator[List[Row]]:
             # Do prediction in batches instead of materializing the whole partition at once
-            batch = []
-            preds = []
-            for row in data:
-                if len(batch) < inference_batch_size:
-                    batch.append(from_vector(row[features_col]))
-                else:
-                    batch_np = np.array(batch)
-                    pred = predict_function(batch_np)
-                    preds.append(pred)
-                    batch = [from_vector(row[features_col])]
-            if len(batch) > 0:
-                batch_np = np.array(batch)
-                pred = predict_function(batch_np)
-                preds.append(pred)
-
-            if preds:
-                res = np.vstack(preds)
-                return res
-            else:
-                return np.array([])
+            if inference_batch_size is None or inference_batch_size <= 0:
+                yield list(data)
+                return
+            data = iter(data)
+            batch = list(islice(data, inference_batch_size))
+            while batch:
+                yield batch
+                batch = list(islice(data, inference_batch_size))
 
         def extract_features_and_predict(model_json: str,
                                          custom_objects: dict,
                                          features_col: str,
+                                         to_output: Callable[[np.ndarray], Any],
                                          data,
-                                         inference_batch_size: Optional[int] = None) -> np.ndarray:
+                                         inference_batch_size: Optional[int] = None) -> Iterator[tuple]:
             model = model_from_json(model_json, custom_objects)
             model.set_weights(weights.value)
-            if inference_batch_size is not None and inference_batch_size > 0:
-                return batched_prediction(data, inference_batch_size, features_col, model.predict)
-            else:
-                return model.predict(np.array([from_vector(x[features_col]) for x in data]))
+            for rows in batches(data, inference_batch_size):
+                if not rows:
+                    continue
+                # fill a single preallocated buffer rather than building an intermediate list of arrays
+                features = np.empty((len(rows),) + from_vector(rows[0][features_col]).shape, dtype=np.float32)
+                for i, row in enumerate(rows):
+                    features[i] = from_vector(row[features_col])
+                # append the prediction to each row, so the results don't have to be zipped back onto the input
+                for row, prediction in zip(rows, model.predict(features)):
+                    yield row + (to_output(prediction),)
 
-        predictions = rdd.mapPartitions(
+        if self.model_type == ModelType.REGRESSION:
+            to_output = float
+            output_col_field = StructField(output_col, DoubleType(), True)
+        else:
+            # we're doing classification and predicting class probabilities
+            to_output = np.ndarray.tolist
+            output_col_field = StructField(output_col, ArrayType(DoubleType()), True)
+        results_rdd = rdd.mapPartitions(
             partial(extract_features_and_predict,
                     self.get_keras_model_config(),
                     self.get_custom_objects(),
                     self.getFeaturesCol(),
+                    to_output,
                     inference_batch_size=self.get_inference_batch_size()
                     )
         )
-        if self.model_type == ModelType.REGRESSION:
-            predictions = predictions.map(lambda x: tuple([float(x)]))
-            output_col_field = StructField(output_col, DoubleType(), True)
-        else:
-            # we're doing classification and predicting class probabilities
-            predictions = predictions.map(lambda x: tuple([x.tolist()]))
-            output_col_field = StructField(output_col, ArrayType(DoubleType()), True)
-        results_rdd = rdd.zip(predictions).map(lambda x: x[0] + x[1])
 
         new_schema.add(output_col_field)
         spark_session = SparkSession.builder.getOrCreate()
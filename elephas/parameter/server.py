@@ -11,7 +11,15 @@ from elephas.utils.sockets import receive, send
 from elephas.utils.serialization import dict_to_model
 from elephas.utils.rwlock import RWLock as Lock
 from elephas.utils.notebook_utils import is_running_in_notebook
-from elephas.utils import subtract_params
+from elephas.utils import subtract_params, subtract_sparse_params, is_sparse_params
+
+
+def apply_delta(weights: list, delta: list) -> list:
+    """Subtract a dense or sparse (see `sparsify_params`) delta sent by a client from the weights
+    """
+    if is_sparse_params(delta):
+        return subtract_sparse_params(weights, delta)
+    return subtract_params(weights, delta)
 
 
 class BaseParameterServer(object):
@@ -125,7 +133,7 @@ class HttpServer(BaseParameterServer):
 
             # Just apply the gradient
             weights_before = self.weights
-            self.weights = subtract_params(weights_before, delta)
+            self.weights = apply_delta(weights_before, delta)
 
             if self.mode == 'asynchronous':
                 self.lock.release()
@@ -205,7 +213,7 @@ class SocketServer(BaseParameterServer):
         if self.mode == 'asynchronous':
             self.lock.acquire_write()
         # apply the gradient
-        self.master_network.set_weights(subtract_params(weights, delta))
+        self.master_network.set_weights(apply_delta(weights, delta))
         if self.mode == 'asynchronous':
             self.lock.release()
 
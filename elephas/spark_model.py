@@ -1,17 +1,21 @@
+import hashlib
 import json
 import subprocess
+import warnings
+import weakref
+import zipfile
+from collections import OrderedDict
 from uuid import uuid4
 from pathlib import Path
-from copy import deepcopy
 from functools import partial
-from itertools import tee
-from typing import Union, List, Dict, Any, Optional, Callable
+from typing import Union, List, Dict, Any, Optional, Callable, Sequence, Tuple
 
 import h5py
 import numpy as np
 import pyspark
 import tensorflow as tf
-from pyspark import RDD
+from pyspark import RDD, StorageLevel, AccumulatorParam
+from pyspark.serializers import CloudPickleSerializer
 from tensorflow.keras.models import load_model
 from tensorflow.keras.models import model_from_json
 from tensorflow.keras.optimizers import get as get_optimizer
@@ -20,15 +24,143 @@ from tensorflow.keras.optimizers import serialize as serialize_optimizer, deseri
 from .mllib import to_matrix, from_matrix, to_vector, from_vector
 from .parameter.factory import ClientServerFactory
 from .utils import lp_to_simple_rdd, to_simple_rdd
-from .utils import model_to_dict
-from .utils import subtract_params, divide_by
-from .worker import AsynchronousSparkWorker, SparkWorker
+from .utils import model_to_dict, CompressedWeights, weights_from_broadcast
+from .utils import flatten_params, unflatten_params
+from .worker import train_partition
+
+
+JAVA_SERIALIZER = 'org.apache.spark.serializer.JavaSerializer'
+KRYO_SERIALIZER = 'org.apache.spark.serializer.KryoSerializer'
+DEFAULT_SPARK_CONF = {'spark.serializer': KRYO_SERIALIZER,
+                      'spark.kryo.registrationRequired': 'false'}
+DISTRIBUTED_CONFIG_MEMBER = 'distributed_config.json'
+# numpy inputs to predict/evaluate below this size are handled on the driver, as scheduling a Spark job costs more
+LOCAL_INFERENCE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _partition_for_workers(rdd: RDD, num_workers: Optional[int]) -> RDD:
+    """Spread an RDD over num_workers partitions, skipping the shuffle if it is already partitioned that way and
+    merging partitions without a shuffle when reducing their number
+    """
+    if not num_workers:
+        return rdd
+    num_partitions = rdd.getNumPartitions()
+    if num_partitions > num_workers:
+        return rdd.coalesce(num_workers)
+    elif num_partitions < num_workers:
+        return rdd.repartition(num_workers)
+    return rdd
+
+
+# Spark contexts whose serializer has already been checked, so the advice is only given once per context
+_SERIALIZER_CHECKED = weakref.WeakSet()
+
+
+def _check_serializer(sc: pyspark.SparkContext):
+    """Warn if a Spark context uses the Java serializer, the first time the context is used for training"""
+    if sc in _SERIALIZER_CHECKED:
+        return
+    _SERIALIZER_CHECKED.add(sc)
+    if sc.getConf().get('spark.serializer', JAVA_SERIALIZER) == JAVA_SERIALIZER:
+        warnings.warn("The Spark context uses the Java serializer, consider setting spark.serializer to "
+                      "{} to reduce the size of serialized weights and gradients".format(KRYO_SERIALIZER))
+
+
+def _is_stopped(sc: pyspark.SparkContext) -> bool:
+    """Whether a Spark context has been stopped, in which case its broadcasts can't be used anymore"""
+    return sc._jsc is None
+
+
+def _weights_fingerprint(weights: List[np.ndarray]) -> str:
+    """Digest of the weights of a model, to detect whether they changed since they were last broadcast"""
+    digest = hashlib.md5()
+    for weight in weights:
+        digest.update(np.ascontiguousarray(weight).data)
+    return digest.hexdigest()
+
+
+# Models built on executors, keyed by the model key of the SparkModel they belong to and whether they are compiled.
+# PySpark reuses its Python worker processes across tasks, so partitions handled by the same worker don't have to
+# rebuild (and recompile) the model. Only the most recently used models are kept.
+_MODEL_CACHE: 'OrderedDict[Tuple[str, bool], tf.keras.Model]' = OrderedDict()
+MODEL_CACHE_SIZE = 4
+
+
+def _get_model(model_key: str, model_json: str, custom_objects: Dict[str, Any],
+               compile_config: Optional[Tuple[Dict[str, Any], Any, List[Any]]] = None) -> tf.keras.Model:
+    """Build a model from its JSON config, or fetch it from the cache of this worker process. The caller is
+    responsible for setting the weights.
+
+    :param model_key: key identifying the master network of a SparkModel, see `SparkModel._get_model_json_bc`
+    :param model_json: JSON config of the Keras model
+    :param custom_objects: Keras custom objects
+    :param compile_config: optional (serialized optimizer, loss, metrics) to compile the model with
+    :return: Keras model
+    """
+    key = (model_key, compile_config is not None)
+    model = _MODEL_CACHE.get(key)
+    if model is None:
+        model = model_from_json(model_json, custom_objects)
+        if compile_config is not None:
+            optimizer, loss, metrics = compile_config
+            model.compile(deserialize_optimizer(optimizer), loss, metrics)
+        _MODEL_CACHE[key] = model
+        if len(_MODEL_CACHE) > MODEL_CACHE_SIZE:
+            _MODEL_CACHE.popitem(last=False)
+    else:
+        _MODEL_CACHE.move_to_end(key)
+    return model
+
+
+def _predict_batch(model: tf.keras.Model, data: np.ndarray, batch_size: int) -> np.ndarray:
+    """Predict a partition with predict_on_batch when it fits in a single batch, which skips building the
+    input pipeline of model.predict"""
+    if len(data) <= batch_size:
+        return model.predict_on_batch(data)
+    return model.predict(data, batch_size=batch_size, verbose=0)
+
+
+def _to_batch(samples: Sequence[np.ndarray]) -> np.ndarray:
+    """Copy equally shaped samples into a single preallocated array, avoiding the intermediate
+    copy of np.array(list_of_arrays). The dtype of the samples is kept, Keras casts to the input dtype of the model.
+    """
+    first = np.asarray(samples[0])
+    if first.dtype.kind not in 'biuf':
+        # strings and objects may vary in length, which a fixed size buffer can't hold
+        return np.array(samples)
+    batch = np.empty((len(samples),) + first.shape, dtype=first.dtype)
+    for i, sample in enumerate(samples):
+        batch[i] = sample
+    return batch
+
+
+TrainingOutcome = Tuple[Optional[np.ndarray], List[Any], int]
+
+
+class TrainingOutcomeAccumulatorParam(AccumulatorParam):
+    """Accumulates the (summed flat deltas, histories, number of workers) training outcomes of synchronous workers.
+    The driver adds the outcome of each task in place as it completes, instead of collecting all of them at once.
+    The deltas start out as None rather than zeros, so the zero value shipped with every task stays small.
+    """
+
+    def zero(self, value: TrainingOutcome) -> TrainingOutcome:
+        return None, [], 0
+
+    def addInPlace(self, value1: TrainingOutcome, value2: TrainingOutcome) -> TrainingOutcome:
+        summed_deltas, histories, number_of_workers = value1
+        if summed_deltas is None:
+            summed_deltas = value2[0]
+        elif value2[0] is not None:
+            summed_deltas += value2[0]
+        histories.extend(value2[1])
+        return summed_deltas, histories, number_of_workers + value2[2]
 
 
 class SparkModel:
 
     def __init__(self, model, mode='asynchronous', frequency='epoch', parameter_server_mode='http', num_workers=None,
-                 custom_objects=None, batch_size=32, port=4000, *args, **kwargs):
+                 custom_objects=None, batch_size=32, port=4000, spark_conf=None, push_threshold=0.0,
+                 compress_weights=False, inference_dtype='float32', *args, **kwargs):
         """SparkModel
 
         Base class for distributed training on RDDs. Spark model takes a Keras
@@ -43,6 +175,14 @@ class SparkModel:
         :param custom_objects: Keras custom objects
         :param batch_size: batch size used for training and inference
         :param port: port used in case of 'http' parameter server mode
+        :param spark_conf: dict of Spark configuration used if a Spark session has to be created for inference,
+        on top of the defaults, which select the Kryo serializer
+        :param push_threshold: float, in `asynchronous` and `hogwild` mode, workers only push the entries of their
+        updates whose absolute value exceeds this threshold to the parameter server (defaults to 0, pushing everything)
+        :param compress_weights: Boolean, compress the weights broadcast to the workers for training and inference,
+        trading CPU time for network transfer (defaults to False)
+        :param inference_dtype: String, floating point type the weights are broadcast in for inference, e.g. `float16`
+        to halve the size of the broadcast. Workers cast them back to the dtype of the model (defaults to `float32`)
         """
         self._training_histories = []
         self._master_network = model
@@ -69,7 +209,23 @@ class SparkModel:
         self.parameter_server_mode = parameter_server_mode
         self.batch_size = batch_size
         self.port = port
+        self.spark_conf = {**DEFAULT_SPARK_CONF, **(spark_conf or {})}
+        self._sc = None
+        self.push_threshold = push_threshold
+        self.compress_weights = compress_weights
+        if np.dtype(inference_dtype).kind != 'f':
+            raise ValueError("inference_dtype has to be a floating point type, got {}".format(inference_dtype))
+        self.inference_dtype = inference_dtype
         self.kwargs = kwargs
+        # broadcast of the master network weights used for inference, reused until the weights change
+        self._weights_broadcast = None
+        self._weights_broadcast_sc = None
+        self._weights_fingerprint = None
+        # broadcast of the master network JSON config, which only changes when the master network is replaced
+        self._model_json_bc = None
+        self._model_json_bc_sc = None
+        # identifies the models built from the JSON broadcast in the model cache of the workers
+        self._model_key = None
 
         self.serialized_model = model_to_dict(model)
         if self.mode != 'synchronous':
@@ -84,7 +240,10 @@ class SparkModel:
             'mode': self.mode,
             'frequency': self.frequency,
             'num_workers': self.num_workers,
-            'batch_size': self.batch_size}
+            'batch_size': self.batch_size,
+            'push_threshold': self.push_threshold,
+            'compress_weights': self.compress_weights,
+            'inference_dtype': self.inference_dtype}
         config = base_config.copy()
         config.update(self.kwargs)
         return config
@@ -109,20 +268,15 @@ class SparkModel:
             Path(file_name).unlink()
 
         if to_hadoop:
-            cluster_file_path = deepcopy(file_name)
+            cluster_file_path = file_name
             file_name = str(uuid4()) + "-temp-model-file." + file_name.split(".")[-1]
 
         model = self._master_network
         model.save(file_name)
-        f = h5py.File(file_name, mode='a')
-
-        f.attrs['distributed_config'] = json.dumps({
+        _write_distributed_config(file_name, json.dumps({
             'class_name': self.__class__.__name__,
             'config': self.get_config()
-        }).encode('utf8')
-
-        f.flush()
-        f.close()
+        }).encode('utf8'))
 
         if to_hadoop:
             # TODO: Consider implementing a try-except clause to use "hdfs dfs" instead
@@ -144,6 +298,63 @@ class SparkModel:
     @master_network.setter
     def master_network(self, network):
         self._master_network = network
+        self._invalidate_weights_broadcast()
+        self._invalidate_model_json_bc()
+
+    def _invalidate_model_json_bc(self):
+        """Drop the broadcast of the master network JSON config"""
+        if self._model_json_bc is not None and not _is_stopped(self._model_json_bc_sc):
+            self._model_json_bc.unpersist(blocking=False)
+        self._model_json_bc = None
+        self._model_json_bc_sc = None
+
+    def _get_model_json_bc(self, sc: pyspark.SparkContext) -> pyspark.Broadcast:
+        """Broadcast the JSON config of the master network on first use, so it isn't shipped with every task.
+        It is broadcast again if the Spark context it belongs to has been replaced or stopped."""
+        if self._model_json_bc is None or self._model_json_bc_sc is not sc or _is_stopped(sc):
+            self._invalidate_model_json_bc()
+            self._model_json_bc = sc.broadcast(self._master_network.to_json())
+            self._model_json_bc_sc = sc
+            self._model_key = uuid4().hex
+        return self._model_json_bc
+
+    def set_weights(self, weights: List[np.ndarray]):
+        """Set the weights of the master network, releasing the broadcast of the previous weights
+
+        :param weights: list of numpy arrays, as returned by `master_network.get_weights()`
+        """
+        self._master_network.set_weights(weights)
+        self._invalidate_weights_broadcast()
+
+    def _invalidate_weights_broadcast(self):
+        """Drop the broadcast of the master network weights, so the next inference call broadcasts them again"""
+        if self._weights_broadcast is not None and not _is_stopped(self._weights_broadcast_sc):
+            self._weights_broadcast.unpersist(blocking=False)
+        self._weights_broadcast = None
+        self._weights_broadcast_sc = None
+        self._weights_fingerprint = None
+
+    def _pack_weights(self, weights: List[np.ndarray]) -> Union[List[np.ndarray], CompressedWeights]:
+        """Prepare weights for broadcasting, compressing them if configured to"""
+        return CompressedWeights(weights) if self.compress_weights else weights
+
+    def _get_weights_broadcast(self, sc: pyspark.SparkContext) -> pyspark.Broadcast:
+        """Broadcast the master network weights, reusing the previous broadcast if it belongs to the same Spark
+        context and the weights haven't changed since. Comparing fingerprints also catches weights changed in
+        place, e.g. by calling `set_weights` or `fit` on the master network directly.
+        """
+        weights = self.master_network.get_weights()
+        fingerprint = _weights_fingerprint(weights)
+        if self._weights_broadcast is None or self._weights_broadcast_sc is not sc or _is_stopped(sc) \
+                or self._weights_fingerprint != fingerprint:
+            self._invalidate_weights_broadcast()
+            # model.set_weights casts the weights back to the dtype of the model on the workers
+            weights = [weight.astype(self.inference_dtype, copy=False) if np.issubdtype(weight.dtype, np.floating)
+                       else weight for weight in weights]
+            self._weights_broadcast = sc.broadcast(self._pack_weights(weights))
+            self._weights_broadcast_sc = sc
+            self._weights_fingerprint = fingerprint
+        return self._weights_broadcast
 
     def start_server(self):
         self.parameter_server.start()
@@ -151,21 +362,40 @@ class SparkModel:
     def stop_server(self):
         self.parameter_server.stop()
 
+    def _run_locally(self, *arrays: np.ndarray) -> bool:
+        """Whether numpy input is small enough that running on the driver beats the overhead of a Spark job"""
+        return (self.num_workers is None or self.num_workers <= 1) and \
+            sum(array.nbytes for array in arrays) < LOCAL_INFERENCE_MAX_BYTES
+
     def predict(self, data: Union[RDD, np.array]) -> List[np.ndarray]:
-        """Perform distributed inference with the model"""
+        """Perform distributed inference with the model. Small numpy arrays are predicted on the driver
+        directly, unless multiple workers are configured."""
         if isinstance(data, (np.ndarray,)):
-            from pyspark.sql import SparkSession
-            sc = SparkSession.builder.getOrCreate().sparkContext
-            data = sc.parallelize(data)
+            if self._run_locally(data):
+                return list(self._master_network.predict(data, batch_size=self.batch_size))
+            data = self.sc.parallelize(data)
         return self._predict(data)
 
     def evaluate(self, x_test: np.array, y_test: np.array, **kwargs) -> Union[List[float], float]:
-        """Perform distributed evaluation with the model"""
-        from pyspark.sql import SparkSession
-        sc = SparkSession.builder.getOrCreate().sparkContext
-        test_rdd = to_simple_rdd(sc, x_test, y_test)
+        """Perform distributed evaluation with the model. Small datasets are evaluated on the driver
+        directly, unless multiple workers are configured."""
+        if self._run_locally(np.asarray(x_test), np.asarray(y_test)):
+            return self._master_network.evaluate(x_test, y_test, **kwargs)
+        test_rdd = to_simple_rdd(self.sc, x_test, y_test)
         return self._evaluate(test_rdd, **kwargs)
 
+    @property
+    def sc(self) -> pyspark.SparkContext:
+        """The active Spark context, or one created with the configuration of this model. It is looked up once and
+        cached, to save the round trips to the JVM on every predict/evaluate call."""
+        if self._sc is None or _is_stopped(self._sc):
+            from pyspark.sql import SparkSession
+            builder = SparkSession.builder
+            for key, value in self.spark_conf.items():
+                builder = builder.config(key, value)
+            self._sc = builder.getOrCreate().sparkContext
+        return self._sc
+
     def fit(self, rdd: RDD, **kwargs):
         """
         Train an elephas model on an RDD. The Keras model configuration as specified
@@ -179,8 +409,7 @@ class SparkModel:
         :param validation_split: percentage of data set aside for validation
         """
         print('>>> Fit model')
-        if self.num_workers:
-            rdd = rdd.repartition(self.num_workers)
+        rdd = _partition_for_workers(rdd, self.num_workers)
 
         if self.mode in ['asynchronous', 'synchronous', 'hogwild']:
             self._fit(rdd, **kwargs)
@@ -190,80 +419,105 @@ class SparkModel:
 
     def _fit(self, rdd: RDD, **kwargs):
         """Protected train method to make wrapping of modes easier"""
+        _check_serializer(rdd.context)
         self._master_network.compile(optimizer=get_optimizer(self.master_optimizer),
                                      loss=self.master_loss,
                                      metrics=self.master_metrics)
-        if self.mode in ['asynchronous', 'hogwild']:
+        is_async = self.mode in ['asynchronous', 'hogwild']
+        if is_async:
             self.start_server()
-        train_config = kwargs
-        freq = self.frequency
-        optimizer = deserialize_optimizer(self.master_optimizer)
-        loss = self.master_loss
-        metrics = self.master_metrics
-        custom = self.custom_objects
-
-        model_json = self._master_network.to_json()
+        # the configuration is pickled with cloudpickle, as broadcasts use the standard pickler, which can't handle
+        # custom losses, metrics or objects defined interactively
+        config = (self._master_network.to_json(), kwargs, self.frequency, self.master_optimizer, self.master_loss,
+                  self.master_metrics, self.custom_objects, self.client if is_async else None, self.push_threshold)
+        config_bc = rdd.context.broadcast(CloudPickleSerializer().dumps(config))
         init = self._master_network.get_weights()
-        parameters = rdd.context.broadcast(init)
+        parameters = rdd.context.broadcast(self._pack_weights(init))
 
-        if self.mode in ['asynchronous', 'hogwild']:
-            print('>>> Initialize workers')
-            worker = AsynchronousSparkWorker(
-                model_json, parameters, self.client, train_config, freq, optimizer, loss, metrics, custom)
+        if is_async:
             print('>>> Distribute load')
-            rdd.mapPartitions(worker.train).collect()
+            rdd.mapPartitions(lambda it: train_partition(config_bc, parameters, it)).collect()
             print('>>> Async training complete.')
             new_parameters = self.client.get_parameters()
         elif self.mode == 'synchronous':
-            worker = SparkWorker(model_json, parameters, train_config,
-                                 optimizer, loss, metrics, custom)
-            training_outcomes = rdd.mapPartitions(worker.train).collect()
-            new_parameters = self._master_network.get_weights()
-            number_of_sub_models = len(training_outcomes)
-            for training_outcome in training_outcomes:
-                grad, history = training_outcome
-                self.training_histories.append(history)
-                weighted_grad = divide_by(grad, number_of_sub_models)
-                new_parameters = subtract_params(new_parameters, weighted_grad)
+            flat_parameters, shapes = flatten_params(self._master_network.get_weights())
+            # stream the deltas of the workers into an accumulator, which sums them on the driver as tasks finish,
+            # so the deltas of all workers never have to be held at once. The deltas are flattened into one array,
+            # making each sum a single vectorized operation rather than one per layer. Unlike a treeReduce, every
+            # delta is sent to the driver, trading driver bandwidth for a driver memory footprint of a single delta.
+            outcomes = rdd.context.accumulator((None, [], 0), TrainingOutcomeAccumulatorParam())
+
+            def train_and_accumulate(data_iterator):
+                for deltas, history in train_partition(config_bc, parameters, data_iterator):
+                    outcomes.add((flatten_params(deltas)[0], [history], 1))
+
+            rdd.foreachPartition(train_and_accumulate)
+            summed_deltas, histories, number_of_sub_models = outcomes.value
+            self.training_histories.extend(histories)
+            if number_of_sub_models:
+                # apply the average delta in place on the flattened master weights
+                np.multiply(summed_deltas, 1.0 / number_of_sub_models, out=summed_deltas)
+                np.subtract(flat_parameters, summed_deltas, out=flat_parameters)
+            new_parameters = unflatten_params(flat_parameters, shapes)
             print('>>> Synchronous training complete.')
         else:
             raise ValueError("Unsupported mode {}".format(self.mode))
+        config_bc.unpersist()
+        parameters.unpersist()
         self._master_network.set_weights(new_parameters)
-        if self.mode in ['asynchronous', 'hogwild']:
+        self._invalidate_weights_broadcast()
+        if is_async:
             self.stop_server()
 
     def _predict(self, rdd: RDD) -> List[np.ndarray]:
         """
         Private distributed predict method called by public predict method, after data has been verified to be an RDD
         """
-        json_model = self.master_network.to_json()
-        weights = self.master_network.get_weights()
-        weights = rdd.context.broadcast(weights)
+        json_model = self._get_model_json_bc(rdd.context)
+        model_key = self._model_key
+        weights = self._get_weights_broadcast(rdd.context)
         custom_objs = self.custom_objects
-
-        def _predict(model_as_json: str, custom_objects: Dict[str, Any], data) -> np.array:
-            model = model_from_json(model_as_json, custom_objects)
-            model.set_weights(weights.value)
-            data = np.array([x for x in data])
-            return model.predict(data)
-
-        def _predict_with_indices(model_as_json: str, custom_objects: Dict[str, Any], data):
-            model = model_from_json(model_as_json, custom_objects)
-            model.set_weights(weights.value)
-            data, indices = zip(*data)
-            data = np.array(data)
-            return zip(model.predict(data), indices)
+        batch_size = self.batch_size
+
+        def _predict(model_as_json: pyspark.Broadcast, custom_objects: Dict[str, Any], data) -> np.array:
+            samples = list(data)
+            if not samples:
+                return []
+            model = _get_model(model_key, model_as_json.value, custom_objects)
+            model.set_weights(weights_from_broadcast(weights))
+            return _predict_batch(model, _to_batch(samples), batch_size)
+
+        def _predict_with_indices(model_as_json: pyspark.Broadcast, custom_objects: Dict[str, Any], data):
+            samples_and_indices = list(data)
+            if not samples_and_indices:
+                return []
+            model = _get_model(model_key, model_as_json.value, custom_objects)
+            model.set_weights(weights_from_broadcast(weights))
+            samples, indices = zip(*samples_and_indices)
+            return zip(_predict_batch(model, _to_batch(samples), batch_size), indices)
 
         if self.num_workers and self.num_workers > 1:
             # if there are multiple workers, we need to retrieve element indices and preserve them throughout
             # the inference process, since we'll need to sort by index before returning the result, as repartitioning
             # does not preserve ordering, but the users will expect prediction results which correspond to the ordering
             # of samples they supplied.
-            rdd = rdd.zipWithIndex()
-            rdd = rdd.repartition(self.num_workers)
-            predictions_and_indices = rdd.mapPartitions(partial(_predict_with_indices, json_model, custom_objs))
-            predictions_sorted_by_index = predictions_and_indices.sortBy(lambda x: x[1])
-            predictions = predictions_sorted_by_index.map(lambda x: x[0]).collect()
+            # zipWithIndex runs a job to count the elements of each partition before the prediction job reads
+            # them again, so keep the input around instead of recomputing its lineage twice
+            persisted = not rdd.is_cached
+            if persisted:
+                rdd = rdd.persist(StorageLevel.MEMORY_AND_DISK)
+            try:
+                indexed_rdd = rdd.zipWithIndex()
+                indexed_rdd = indexed_rdd.repartition(self.num_workers)
+                predictions_and_indices = indexed_rdd.mapPartitions(partial(_predict_with_indices, json_model,
+                                                                            custom_objs))
+                # the results are collected anyway, so sort them on the driver rather than with another shuffle
+                predictions_and_indices = predictions_and_indices.collect()
+            finally:
+                if persisted:
+                    rdd.unpersist(blocking=False)
+            predictions_and_indices.sort(key=lambda x: x[1])
+            predictions = [prediction for prediction, _ in predictions_and_indices]
         else:
             # if there are no workers specified or only a single worker, we don't need to worry about handling index
             # values, since there will be no shuffling
@@ -273,29 +527,29 @@ class SparkModel:
 
     def _evaluate(self, rdd: RDD, **kwargs) -> Union[List[float], float]:
         """Private distributed evaluate method called by public evaluate method, after data has been verified to be an RDD"""
-        json_model = self.master_network.to_json()
-        optimizer = deserialize_optimizer(self.master_optimizer)
+        json_model = self._get_model_json_bc(rdd.context)
+        model_key = self._model_key
+        optimizer = self.master_optimizer
         loss = self.master_loss
-        weights = self.master_network.get_weights()
-        weights = rdd.context.broadcast(weights)
+        weights = self._get_weights_broadcast(rdd.context)
         custom_objects = self.custom_objects
         metrics = self.master_metrics
 
-        def _evaluate(model, optimizer, loss: Callable[[tf.Tensor, tf.Tensor], tf.Tensor], custom_objects: Dict[str, Any], metrics: List[str], kwargs: Dict[str, Any], data_iterator) -> List[Union[float, int]]:
-            model = model_from_json(model, custom_objects)
-            model.compile(optimizer, loss, metrics)
-            model.set_weights(weights.value)
-            feature_iterator, label_iterator = tee(data_iterator, 2)
-            x_test = np.asarray([x for x, y in feature_iterator])
-            y_test = np.asarray([y for x, y in label_iterator])
+        def _evaluate(model: pyspark.Broadcast, optimizer: Dict[str, Any], loss: Callable[[tf.Tensor, tf.Tensor], tf.Tensor], custom_objects: Dict[str, Any], metrics: List[str], kwargs: Dict[str, Any], data_iterator) -> List[Union[float, int]]:
+            samples = list(data_iterator)
+            if not samples:
+                # nothing to evaluate, and an empty partition carries no weight in the aggregation
+                return []
+            model = _get_model(model_key, model.value, custom_objects, compile_config=(optimizer, loss, metrics))
+            model.set_weights(weights_from_broadcast(weights))
+            x_test, y_test = _to_batch([x for x, _ in samples]), _to_batch([y for _, y in samples])
             evaluation_results = model.evaluate(x_test, y_test, **kwargs)
             evaluation_results = [evaluation_results] if not isinstance(evaluation_results, list) \
                 else evaluation_results
             # return the evaluation results and the size of the sample
             return [evaluation_results + [len(x_test)]]
 
-        if self.num_workers:
-            rdd = rdd.repartition(self.num_workers)
+        rdd = _partition_for_workers(rdd, self.num_workers)
         results = rdd.mapPartitions(partial(_evaluate, json_model, optimizer, loss, custom_objects, metrics, kwargs))
         mapping_function = lambda x: tuple(x[-1] * x[i] for i in range(len(x) - 1)) + (x[-1],)
         reducing_function = lambda x, y: tuple(x[i] + y[i] for i in range(len(x)))
@@ -336,7 +590,7 @@ class SparkMLlibModel(SparkModel):
         """Train an elephas model on an RDD of LabeledPoints
         """
         rdd = lp_to_simple_rdd(labeled_points, categorical, nb_classes)
-        rdd = rdd.repartition(self.num_workers)
+        rdd = _partition_for_workers(rdd, self.num_workers)
         self._fit(rdd=rdd, epochs=epochs, batch_size=batch_size,
                   verbose=verbose, validation_split=validation_split)
 
@@ -352,6 +606,29 @@ class SparkMLlibModel(SparkModel):
                 'Provide either an MLLib matrix or vector, got {}'.format(mllib_data.__name__))
 
 
+def _write_distributed_config(file_name: str, distributed_config: bytes):
+    """Attach the elephas configuration to a saved Keras model. Depending on the Keras version, `.keras` files are
+    either HDF5 files or zip archives, in which case the configuration is added as an archive member.
+    HDF5 is checked first, as it has a signature at the start of the file, while `zipfile.is_zipfile` looks for an
+    end of archive record anywhere in the tail of the file.
+    """
+    if h5py.is_hdf5(file_name):
+        with h5py.File(file_name, mode='r+') as f:
+            f.attrs['distributed_config'] = distributed_config
+    else:
+        with zipfile.ZipFile(file_name, mode='a') as archive:
+            archive.writestr(DISTRIBUTED_CONFIG_MEMBER, distributed_config)
+
+
+def _read_distributed_config(file_name: str) -> bytes:
+    """Read the elephas configuration written by `_write_distributed_config`"""
+    if h5py.is_hdf5(file_name):
+        with h5py.File(file_name, mode='r') as f:
+            return f.attrs.get('distributed_config')
+    with zipfile.ZipFile(file_name, mode='r') as archive:
+        return archive.read(DISTRIBUTED_CONFIG_MEMBER)
+
+
 def load_spark_model(
         file_name: str, from_hadoop: bool = False
 ) -> Union[SparkModel, SparkMLlibModel]:
@@ -374,9 +651,8 @@ def load_spark_model(
         file_name = temp_file
 
     model = load_model(file_name)
-    f = h5py.File(file_name, mode="r")
 
-    elephas_conf = json.loads(f.attrs.get("distributed_config"))
+    elephas_conf = json.loads(_read_distributed_config(file_name))
     class_name = elephas_conf.get("class_name")
     config = elephas_conf.get("config")
 
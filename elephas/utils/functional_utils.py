@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 
@@ -41,3 +41,66 @@ def divide_by(array_list: List[np.array], num_workers: int) -> List[np.array]:
     :return:
     """
     return [x / num_workers for x in array_list]
+
+
+def flatten_params(param_list: List[np.array]) -> Tuple[np.array, List[Tuple[int, ...]]]:
+    """Concatenate a list of parameters into a single flat array, so arithmetic on
+    all of them takes a single vectorized operation
+
+    :param param_list: list of numpy arrays
+    :return: flat numpy array and the shapes of the original arrays
+    """
+    shapes = [np.shape(x) for x in param_list]
+    if not param_list:
+        return np.zeros(0), shapes
+    return np.concatenate([np.ravel(x) for x in param_list]), shapes
+
+
+def unflatten_params(flat_params: np.array, shapes: List[Tuple[int, ...]]) -> List[np.array]:
+    """Split a flat array created by `flatten_params` back into a list of parameters
+
+    :param flat_params: flat numpy array
+    :param shapes: shapes of the original arrays
+    :return: list of numpy arrays
+    """
+    split_indices = np.cumsum([int(np.prod(shape)) for shape in shapes])[:-1]
+    return [x.reshape(shape) for x, shape in zip(np.split(flat_params, split_indices), shapes)]
+
+
+def sparsify_params(param_list: List[np.array], threshold: float) -> List[Tuple[np.array, np.array]]:
+    """Keep only the entries of each parameter whose absolute value exceeds threshold
+
+    :param param_list: list of numpy arrays
+    :param threshold: entries with an absolute value up to threshold are dropped
+    :return: list of (flat indices, values) pairs
+    """
+    sparse_params = []
+    for x in param_list:
+        flat = np.ravel(x)
+        indices = np.flatnonzero(np.abs(flat) > threshold)
+        sparse_params.append((indices, flat[indices]))
+    return sparse_params
+
+
+def is_sparse_params(param_list: list) -> bool:
+    """Whether a list of parameters was created by `sparsify_params`
+
+    :param param_list: list of numpy arrays or (flat indices, values) pairs
+    :return: boolean
+    """
+    return bool(param_list) and isinstance(param_list[0], tuple)
+
+
+def subtract_sparse_params(param_list_left: List[np.array],
+                           sparse_param_list_right: List[Tuple[np.array, np.array]]) -> List[np.array]:
+    """Subtract a list of sparse parameters, as created by `sparsify_params`,
+    from a list of dense parameters
+
+    :param param_list_left: list of numpy arrays
+    :param sparse_param_list_right: list of (flat indices, values) pairs
+    :return: list of numpy arrays
+    """
+    result = [np.array(x) for x in param_list_left]
+    for x, (indices, values) in zip(result, sparse_param_list_right):
+        x.reshape(-1)[indices] -= values
+    return result
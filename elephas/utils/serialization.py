@@ -1,5 +1,7 @@
-from typing import Dict, Any, Optional
+import zlib
+from typing import Dict, Any, Optional, List
 
+import numpy as np
 from tensorflow.keras.models import model_from_json, Model
 
 
@@ -23,3 +25,47 @@ def dict_to_model(_dict: Dict[str, Any], custom_objects: Optional[Dict[str, Any]
     model = model_from_json(_dict['model'], custom_objects)
     model.set_weights(_dict['weights'])
     return model
+
+
+class CompressedWeights:
+    """Model weights compressed with zlib, used to reduce the size of weight broadcasts.
+    The decompressed weights are cached on the instance, so a Python worker reading the same
+    broadcast for several partitions only decompresses them once.
+    """
+
+    def __init__(self, weights: List[np.ndarray], level: int = 1):
+        """
+        :param weights: list of numpy arrays
+        :param level: zlib compression level, low levels trade compression ratio for speed
+        """
+        self.buffers = [zlib.compress(np.ascontiguousarray(w).tobytes(), level) for w in weights]
+        self.metadata = [(np.shape(w), np.asarray(w).dtype.str) for w in weights]
+        self._weights = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_weights'] = None
+        return state
+
+    def decompress(self) -> List[np.ndarray]:
+        """Restore the original weights
+
+        :return: list of numpy arrays
+        """
+        if self._weights is None:
+            self._weights = [np.frombuffer(zlib.decompress(buffer), dtype=dtype).reshape(shape)
+                             for buffer, (shape, dtype) in zip(self.buffers, self.metadata)]
+        return self._weights
+
+
+def weights_from_broadcast(broadcast) -> List[np.ndarray]:
+    """Read model weights from a broadcast variable holding either a list of numpy arrays
+    or `CompressedWeights`
+
+    :param broadcast: PySpark broadcast variable
+    :return: list of numpy arrays
+    """
+    weights = broadcast.value
+    if isinstance(weights, CompressedWeights):
+        return weights.decompress()
+    return weights
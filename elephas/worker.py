@@ -1,10 +1,12 @@
+import pickle
+
 import numpy as np
 from itertools import tee
 from tensorflow.keras.models import model_from_json
 from tensorflow.keras.optimizers import get as get_optimizer
 from tensorflow.python.keras.utils.generic_utils import slice_arrays
 
-from .utils import subtract_params
+from .utils import add_params, subtract_params, sparsify_params, weights_from_broadcast
 from .parameter import BaseParameterClient
 
 
@@ -31,7 +33,7 @@ class SparkWorker(object):
         self.model = model_from_json(self.json, self.custom_objects)
         self.model.compile(optimizer=optimizer,
                            loss=self.master_loss, metrics=self.master_metrics)
-        self.model.set_weights(self.parameters.value)
+        self.model.set_weights(weights_from_broadcast(self.parameters))
 
         feature_iterator, label_iterator = tee(data_iterator, 2)
         x_train = np.asarray([x for x, y in feature_iterator])
@@ -54,7 +56,7 @@ class AsynchronousSparkWorker(object):
     """
 
     def __init__(self, json, parameters, client, train_config, frequency,
-                 master_optimizer, master_loss, master_metrics, custom_objects):
+                 master_optimizer, master_loss, master_metrics, custom_objects, push_threshold=0.0):
 
         if isinstance(client, BaseParameterClient):
             # either supply a client object directly
@@ -72,6 +74,33 @@ class AsynchronousSparkWorker(object):
         self.parameters = parameters
         self.custom_objects = custom_objects
         self.model = None
+        self.push_threshold = push_threshold
+        self.residuals = None
+
+    def prepare_update(self, deltas):
+        """Drop the entries of the deltas whose absolute value doesn't exceed the push threshold, if one is set,
+        and send the rest as sparse updates. Dropped entries are kept and added to the next update, so small
+        changes still reach the parameter server once they add up.
+        """
+        if not self.push_threshold:
+            return deltas
+        if self.residuals is not None:
+            deltas = add_params(deltas, self.residuals)
+        update = sparsify_params(deltas, self.push_threshold)
+        for residual, (indices, _) in zip(deltas, update):
+            residual.reshape(-1)[indices] = 0
+        self.residuals = deltas
+        return update
+
+    def flush_residuals(self):
+        """Send the entries held back by `prepare_update` which haven't been pushed yet, so they aren't lost
+        once the worker is done training
+        """
+        if self.residuals is not None:
+            update = sparsify_params(self.residuals, 0.0)
+            if any(len(indices) for indices, _ in update):
+                self.client.update_parameters(update)
+            self.residuals = None
 
     def train(self, data_iterator):
         """Train a keras model on a worker and send asynchronous updates
@@ -87,7 +116,7 @@ class AsynchronousSparkWorker(object):
         self.model = model_from_json(self.json, self.custom_objects)
         self.model.compile(optimizer=get_optimizer(self.master_optimizer),
                            loss=self.master_loss, metrics=self.master_metrics)
-        self.model.set_weights(self.parameters.value)
+        self.model.set_weights(weights_from_broadcast(self.parameters))
 
         epochs = self.train_config['epochs']
         batch_size = self.train_config.get('batch_size')
@@ -110,7 +139,7 @@ class AsynchronousSparkWorker(object):
                 weights_after_training = self.model.get_weights()
                 deltas = subtract_params(
                     weights_before_training, weights_after_training)
-                self.client.update_parameters(deltas)
+                self.client.update_parameters(self.prepare_update(deltas))
         elif self.frequency == 'batch':
             for epoch in range(epochs):
                 if x_train.shape[0] > batch_size:
@@ -124,8 +153,28 @@ class AsynchronousSparkWorker(object):
                         weights_after_training = self.model.get_weights()
                         deltas = subtract_params(
                             weights_before_training, weights_after_training)
-                        self.client.update_parameters(deltas)
+                        self.client.update_parameters(self.prepare_update(deltas))
         else:
             raise ValueError(
                 'frequency parameter can be `epoch` or `batch, got {}'.format(self.frequency))
+        self.flush_residuals()
         yield []
+
+
+def train_partition(config_bc, params_bc, data_iterator):
+    """Train a keras model on a partition. The worker is built on the executor from the broadcast configuration,
+    so tasks only have to ship the ids of the two broadcasts instead of a pickled worker instance.
+
+    :param config_bc: broadcast of the pickled tuple (model_json, train_config, frequency, optimizer, loss,
+        metrics, custom_objects, client, push_threshold). Without a client, training is synchronous.
+    :param params_bc: broadcast of the initial weights
+    :param data_iterator: iterator over the (features, label) pairs of the partition
+    """
+    (model_json, train_config, frequency, optimizer, loss, metrics, custom_objects,
+     client, push_threshold) = pickle.loads(config_bc.value)
+    if client is None:
+        worker = SparkWorker(model_json, params_bc, train_config, optimizer, loss, metrics, custom_objects)
+    else:
+        worker = AsynchronousSparkWorker(model_json, params_bc, client, train_config, frequency, optimizer, loss,
+                                         metrics, custom_objects, push_threshold=push_threshold)
+    return worker.train(data_iterator)
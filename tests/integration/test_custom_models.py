@@ -7,12 +7,13 @@ from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense
 from tensorflow.keras.optimizers import SGD
 
+import elephas.spark_model
 from elephas.spark_model import SparkModel
 from elephas.utils import to_simple_rdd
 
 
 @pytest.mark.parametrize('mode', ['synchronous', 'asynchronous', 'hogwild'])
-def test_training_custom_activation(mode, spark_context):
+def test_training_custom_activation(mode, spark_context, monkeypatch):
     def custom_activation(x):
         return sigmoid(x) + 1
 
@@ -34,5 +35,6 @@ def test_training_custom_activation(mode, spark_context):
                              custom_objects={'custom_activation': custom_activation},
                              port=4000 + random.randint(0, 800))
     spark_model.fit(rdd, epochs=1, batch_size=16, verbose=0, validation_split=0.1)
+    monkeypatch.setattr(elephas.spark_model, 'LOCAL_INFERENCE_MAX_BYTES', 0)
     assert spark_model.predict(x_test)
     assert spark_model.evaluate(x_test, y_test)
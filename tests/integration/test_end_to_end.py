@@ -3,6 +3,7 @@ from math import isclose
 
 from tensorflow.keras.optimizers import SGD
 
+import elephas.spark_model
 from elephas.spark_model import SparkModel
 from elephas.utils.rdd_utils import to_simple_rdd
 
@@ -26,7 +27,10 @@ def _generate_port_number(port=3000, _count=count(1)):
                           ('hogwild', 'http', 2),
                           ('hogwild', 'socket', None),
                           ('hogwild', 'socket', 2)])
-def test_training_classification(spark_context, mode, parameter_server_mode, num_workers, mnist_data, classification_model):
+def test_training_classification(spark_context, mode, parameter_server_mode, num_workers, mnist_data, classification_model,
+                                 monkeypatch):
+    # force the distributed path, small numpy arrays would be handled on the driver
+    monkeypatch.setattr(elephas.spark_model, 'LOCAL_INFERENCE_MAX_BYTES', 0)
     # Define basic parameters
     batch_size = 64
     epochs = 10
@@ -81,7 +85,9 @@ def test_training_classification(spark_context, mode, parameter_server_mode, num
                           ('hogwild', 'socket', None),
                           ('hogwild', 'socket', 2)])
 def test_training_regression(spark_context, mode, parameter_server_mode, num_workers, boston_housing_dataset,
-                             regression_model):
+                             regression_model, monkeypatch):
+    # force the distributed path, small numpy arrays would be handled on the driver
+    monkeypatch.setattr(elephas.spark_model, 'LOCAL_INFERENCE_MAX_BYTES', 0)
     x_train, y_train, x_test, y_test = boston_housing_dataset
     rdd = to_simple_rdd(spark_context, x_train, y_train)
 
@@ -115,7 +121,9 @@ def test_training_regression(spark_context, mode, parameter_server_mode, num_wor
     assert isclose(evals[2], spark_model.master_network.evaluate(x_test, y_test)[2], abs_tol=0.01)
 
 
-def test_training_regression_no_metrics(spark_context, boston_housing_dataset, regression_model):
+def test_training_regression_no_metrics(spark_context, boston_housing_dataset, regression_model, monkeypatch):
+    # force the distributed path, small numpy arrays would be handled on the driver
+    monkeypatch.setattr(elephas.spark_model, 'LOCAL_INFERENCE_MAX_BYTES', 0)
     x_train, y_train, x_test, y_test = boston_housing_dataset
     rdd = to_simple_rdd(spark_context, x_train, y_train)
 
@@ -144,4 +152,95 @@ def test_training_regression_no_metrics(spark_context, boston_housing_dataset, r
                    spark_model.master_network.evaluate(x_test, y_test), abs_tol=0.01)
 
 
+def test_weights_broadcast_reused_until_weights_change(spark_context, boston_housing_dataset, regression_model):
+    x_train, y_train, x_test, y_test = boston_housing_dataset
+    rdd = to_simple_rdd(spark_context, x_train, y_train)
+    test_rdd = spark_context.parallelize(x_test)
+
+    sgd = SGD(lr=0.0000001)
+    regression_model.compile(sgd, 'mse')
+    spark_model = SparkModel(regression_model, frequency='epoch', mode='synchronous', port=_generate_port_number())
+
+    spark_model.predict(test_rdd)
+    weights_broadcast = spark_model._weights_broadcast
+    spark_model.predict(test_rdd)
+    # the weights haven't changed, so the broadcast should be reused
+    assert spark_model._weights_broadcast is weights_broadcast
+
+    spark_model.fit(rdd, epochs=1, batch_size=64, verbose=0, validation_split=0.1)
+    predictions = spark_model.predict(test_rdd)
+    assert spark_model._weights_broadcast is not weights_broadcast
+    assert all(np.isclose(x, y, 0.01) for x, y in zip(predictions, spark_model.master_network.predict(x_test)))
+
+
+def test_weights_broadcast_follows_in_place_changes(spark_context, boston_housing_dataset, regression_model):
+    _, _, x_test, _ = boston_housing_dataset
+    test_rdd = spark_context.parallelize(x_test)
+
+    regression_model.compile(SGD(lr=0.0000001), 'mse')
+    spark_model = SparkModel(regression_model, frequency='epoch', mode='synchronous', port=_generate_port_number())
+    spark_model.predict(test_rdd)
+
+    # change the weights of the master network behind the back of the spark model
+    spark_model.master_network.set_weights([weight + 1 for weight in spark_model.master_network.get_weights()])
+    predictions = spark_model.predict(test_rdd)
+    assert all(np.isclose(x, y, 0.01) for x, y in zip(predictions, spark_model.master_network.predict(x_test)))
+
+    spark_model.set_weights([np.zeros_like(weight) for weight in spark_model.master_network.get_weights()])
+    assert spark_model._weights_broadcast is None
+    assert all(np.allclose(x, 0) for x in spark_model.predict(test_rdd))
+
+
+def test_small_numpy_inputs_run_on_driver(spark_context, boston_housing_dataset, regression_model, monkeypatch):
+    x_train, y_train, x_test, y_test = boston_housing_dataset
+
+    sgd = SGD(lr=0.0000001)
+    regression_model.compile(sgd, 'mse', ['mae'])
+    spark_model = SparkModel(regression_model, frequency='epoch', mode='synchronous', port=_generate_port_number())
+
+    predictions = spark_model.predict(x_test)
+    evals = spark_model.evaluate(x_test, y_test)
+    # no Spark job was needed, so nothing has been broadcast
+    assert spark_model._weights_broadcast is None
+
+    test_rdd = spark_context.parallelize(x_test)
+    assert all(np.isclose(x, y, 0.01) for x, y in zip(predictions, spark_model.predict(test_rdd)))
+    monkeypatch.setattr(elephas.spark_model, 'LOCAL_INFERENCE_MAX_BYTES', 0)
+    assert isclose(evals[0], spark_model.evaluate(x_test, y_test)[0], abs_tol=0.01)
+
+
+@pytest.mark.parametrize('mode,parameter_server_mode,frequency',
+                         [('asynchronous', 'http', 'epoch'),
+                          ('asynchronous', 'socket', 'batch'),
+                          ('hogwild', 'http', 'batch')])
+def test_training_with_push_threshold(spark_context, mode, parameter_server_mode, frequency, boston_housing_dataset,
+                                      regression_model):
+    x_train, y_train, x_test, y_test = boston_housing_dataset
+    rdd = to_simple_rdd(spark_context, x_train, y_train)
+
+    sgd = SGD(lr=0.0000001)
+    regression_model.compile(sgd, 'mse', ['mae'])
+    initial_weights = regression_model.get_weights()
+    spark_model = SparkModel(regression_model, frequency=frequency, mode=mode, num_workers=2,
+                             parameter_server_mode=parameter_server_mode, port=_generate_port_number(),
+                             push_threshold=1e-9)
+
+    spark_model.fit(rdd, epochs=2, batch_size=64, verbose=0, validation_split=0.1)
+
+    assert spark_model.get_config()['push_threshold'] == 1e-9
+    assert any(not np.array_equal(before, after)
+               for before, after in zip(initial_weights, spark_model.master_network.get_weights()))
+
+
+def test_inference_dtype(spark_context, mnist_data, classification_model):
+    _, _, x_test, y_test = mnist_data
+    classification_model.compile(SGD(lr=0.1), 'categorical_crossentropy', ['acc'])
+    spark_model = SparkModel(classification_model, frequency='epoch', mode='synchronous', num_workers=2,
+                             inference_dtype='float16', port=_generate_port_number())
+
+    predictions = spark_model.predict(spark_context.parallelize(x_test[:1000]))
+    assert all(np.allclose(x, y, atol=0.01) for x, y in
+               zip(predictions, spark_model.master_network.predict(x_test[:1000])))
 
+    with pytest.raises(ValueError):
+        SparkModel(classification_model, mode='synchronous', inference_dtype='int8')
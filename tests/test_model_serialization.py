@@ -3,7 +3,7 @@ import pytest
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Dense, Input
 
-from elephas.spark_model import SparkModel
+from elephas.spark_model import SparkModel, load_spark_model
 
 
 def test_sequential_serialization(spark_context, classification_model):
@@ -33,3 +33,13 @@ def test_model_serialization():
                              mode='synchronous', foo="bar")
     spark_model.save("elephas_model.h5")
 
+
+@pytest.mark.parametrize('file_name', ['elephas_model.h5', 'elephas_model.keras'])
+def test_save_and_load(classification_model, file_name):
+    classification_model.compile(
+        optimizer="sgd", loss="categorical_crossentropy", metrics=["acc"])
+    spark_model = SparkModel(classification_model, frequency='batch', mode='synchronous', foo="bar")
+    spark_model.save(file_name, overwrite=True)
+    loaded_model = load_spark_model(file_name)
+    assert loaded_model.get_config() == spark_model.get_config()
+    assert loaded_model.master_network.to_json() == spark_model.master_network.to_json()
@@ -39,3 +39,41 @@ def test_divide_by():
     res = functional_utils.divide_by(x, num_workers=10)
     assert res[0].shape == x[0].shape
     assert res[0][0, 0] == 0.1
+
+
+def test_flatten_params():
+    x = [np.ones((3, 4)), np.zeros(5), np.full((2, 2, 2), 2.0)]
+    flat, shapes = functional_utils.flatten_params(x)
+    assert flat.shape == (25,)
+    assert shapes == [(3, 4), (5,), (2, 2, 2)]
+    assert flat.sum() == 12 + 16
+
+
+def test_unflatten_params():
+    x = [np.arange(12).reshape(3, 4), np.arange(5), np.arange(8).reshape(2, 2, 2)]
+    res = functional_utils.unflatten_params(*functional_utils.flatten_params(x))
+    assert len(res) == 3
+    for original, restored in zip(x, res):
+        assert np.array_equal(original, restored)
+
+
+def test_sparsify_params():
+    x = [np.array([[0.5, -2.0], [0.1, 3.0]]), np.array([0.0, 0.2])]
+    res = functional_utils.sparsify_params(x, threshold=0.4)
+    assert functional_utils.is_sparse_params(res)
+    assert not functional_utils.is_sparse_params(x)
+    assert np.array_equal(res[0][0], [0, 1, 3])
+    assert np.array_equal(res[0][1], [0.5, -2.0, 3.0])
+    assert len(res[1][0]) == 0
+
+
+def test_subtract_sparse_params():
+    p1 = [np.ones((2, 2)), np.ones(3)]
+    p2 = [np.array([[0.5, 0.0], [0.0, 2.0]]), np.zeros(3)]
+
+    res = functional_utils.subtract_sparse_params(p1, functional_utils.sparsify_params(p2, threshold=0.0))
+
+    assert np.array_equal(res[0], [[0.5, 1.0], [1.0, -1.0]])
+    assert np.array_equal(res[1], np.ones(3))
+    # the input parameters are left untouched
+    assert np.array_equal(p1[0], np.ones((2, 2)))
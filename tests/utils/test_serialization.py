@@ -1,3 +1,7 @@
+import pickle
+from types import SimpleNamespace
+
+import numpy as np
 import pytest
 from tensorflow.keras.models import Sequential
 from elephas.utils import serialization
@@ -18,3 +22,21 @@ def test_dict_to_model():
 
     recovered = serialization.dict_to_model(dict_model)
     assert recovered.to_json() == model.to_json()
+
+
+def test_compressed_weights():
+    weights = [np.random.rand(3, 4).astype(np.float32), np.arange(5)]
+    compressed = pickle.loads(pickle.dumps(serialization.CompressedWeights(weights)))
+
+    recovered = serialization.weights_from_broadcast(SimpleNamespace(value=compressed))
+    assert len(recovered) == len(weights)
+    for original, restored in zip(weights, recovered):
+        assert restored.dtype == original.dtype
+        assert np.array_equal(restored, original)
+    # decompressed weights are cached
+    assert serialization.weights_from_broadcast(SimpleNamespace(value=compressed)) is recovered
+
+
+def test_uncompressed_weights_from_broadcast():
+    weights = [np.ones((2, 2))]
+    assert serialization.weights_from_broadcast(SimpleNamespace(value=weights)) is weights